@@ -0,0 +1,35 @@
+"""Added primary key on artist_release table
+
+Revision ID: 4c1e9a7b2d3f
+Revises: ec7b37286da0
+Create Date: 2026-10-15 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c1e9a7b2d3f'
+down_revision = 'ec7b37286da0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # links inserted twice by concurrent traversal steps and half empty rows have to go
+    # before the key can be added
+    op.execute('DELETE FROM artist_release WHERE artist_id IS NULL OR release_id IS NULL')
+    op.execute(
+        'DELETE FROM artist_release a USING artist_release b '
+        'WHERE a.artist_id = b.artist_id AND a.release_id = b.release_id AND a.ctid > b.ctid'
+    )
+    op.alter_column('artist_release', 'artist_id', existing_type=sa.Integer(), nullable=False)
+    op.alter_column('artist_release', 'release_id', existing_type=sa.Integer(), nullable=False)
+    op.create_primary_key('artist_release_pkey', 'artist_release', ['artist_id', 'release_id'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('artist_release_pkey', 'artist_release', type_='primary')
+    op.alter_column('artist_release', 'release_id', existing_type=sa.Integer(), nullable=True)
+    op.alter_column('artist_release', 'artist_id', existing_type=sa.Integer(), nullable=True)
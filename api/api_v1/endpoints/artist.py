@@ -1,3 +1,4 @@
+import logging
 from typing import Any, List, Union
 from collections import OrderedDict
 
@@ -13,6 +14,8 @@ from api.dependencies import get_db
 from services.traverser import start_traversing
 from services.disco_ops import artist_sorted_search
 
+log = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
@@ -24,9 +27,10 @@ def get_artist_links(
     artist = artist_crud.get_by_discogs_id(db=db, discogs_id=artist_discogs_id)
 
     linked, _ = artist.get_connected_artists()
-    for l in linked.keys():
-        for a in linked[l]:
-            print(f"{l}, {a.previous[1]} => {a.previous[0]} => {a.name}")
+    if log.isEnabledFor(logging.DEBUG):
+        for l in linked:
+            for a in linked[l]:
+                log.debug("%s, %s => %s => %s", l, a.previous[1], a.previous[0], a.name)
     return 'done'
 
 
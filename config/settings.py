@@ -7,6 +7,10 @@ class Settings(BaseSettings):
     api_v1: str = '/api/v1'
     database_url: str = ''
     test_database_url: str = ''
+    db_pool_size: int = 10
+    db_max_overflow: int = 5
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 1800
     discogs_key: str = ''
     discogs_secret: str = ''
     token_url: str = ''
@@ -14,6 +18,9 @@ class Settings(BaseSettings):
     access_token_url: str = ''
     token: str = ''
     secret: str = ''
+    discogs_cache_path: str = ''
+    discogs_cache_ttl: int = 7 * 24 * 3600
+    traversal_checkpoint_path: str = ''
 
     class Config:
         env_file = '.env'
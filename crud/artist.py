@@ -1,11 +1,15 @@
-from typing import List, Optional, Any
+from typing import Iterable, List, Optional, Any, Tuple
 
 from fastapi.encoders import jsonable_encoder
+from sqlalchemy import Integer, column, literal, select, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 
 from crud.base import CRUDBase, ModelType
 from crud.release import release_crud
-from models.artist import Artist
+from models.artist import Artist, artist_release
+from models.release import Release
 from schemas.artist import ArtistCreate, ArtistUpdate
 from schemas.release import ReleaseCreate
 
@@ -17,6 +21,16 @@ class CRUDItem(CRUDBase[Artist, ArtistCreate, ArtistUpdate]):
     def get_by_discogs_id(self, db: Session, discogs_id: str) -> Optional[ModelType]:
         return db.query(self.model).filter(Artist.discogs_id == discogs_id).first()
 
+    def select_lean_by_discogs_id(self, db: Session, discogs_id: str) -> Optional[Row]:
+        """
+        Lean lookup returning a plain (id, name, discogs_id, page_url) row, skips building and
+        tracking an ORM instance.
+        """
+        stmt = select(
+            Artist.id, Artist.name, Artist.discogs_id, Artist.page_url
+        ).where(Artist.discogs_id == discogs_id).limit(1)
+        return db.execute(stmt).first()
+
     def add_artist_release(self, db: Session, artist_id, release):
         artist = db.query(Artist).get(artist_id)
         if not artist:
@@ -27,28 +41,67 @@ class CRUDItem(CRUDBase[Artist, ArtistCreate, ArtistUpdate]):
         db.refresh(artist)
         return artist
 
+    def link_releases(self, db: Session, links: Iterable[Tuple[int, int]]) -> None:
+        """
+        Link artists to releases given as (artist discogs_id, release discogs_id) pairs.
+        Both rows have to exist already, pairs that are linked already are skipped, also when a
+        concurrent transaction links them first. Links are inserted in id order, like
+        create_many. Nothing is committed, that is left to the caller.
+        """
+        links = sorted(set(links))
+        if not links:
+            return
+        pairs = values(
+            column('artist_discogs_id', Integer), column('release_discogs_id', Integer), name='links'
+        ).data(links)
+        # resolving both ids, skipping existing links and inserting is a single round trip
+        db.execute(insert(artist_release).from_select(
+            ['artist_id', 'release_id'],
+            select(Artist.id, Release.id).select_from(pairs).join(
+                Artist, Artist.discogs_id == pairs.c.artist_discogs_id
+            ).join(
+                Release, Release.discogs_id == pairs.c.release_discogs_id
+            ).order_by(Artist.id, Release.id)
+        ).on_conflict_do_nothing(index_elements=['artist_id', 'release_id']))
+
+    def upsert_and_link(self, db: Session, artist_in: ArtistCreate, release_ids: Iterable[int]) -> Row:
+        """
+        Insert the artist, or refresh its name if the discogs_id is known already, and link it
+        to the given releases (by discogs_id) that are not linked yet. Two statements no matter
+        how many releases, nothing is committed. Returns the (id, name, discogs_id, page_url) row.
+        """
+        columns = set(self.model.__table__.columns.keys()) - {'id'}
+        values = {k: v for k, v in jsonable_encoder(artist_in).items() if k in columns}
+        stmt = insert(Artist).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['discogs_id'],
+            set_={'name': stmt.excluded.name},
+        ).returning(Artist.id, Artist.name, Artist.discogs_id, Artist.page_url)
+        artist = db.execute(stmt).first()
+
+        release_ids = {int(x) for x in release_ids}
+        if release_ids:
+            db.execute(insert(artist_release).from_select(
+                ['artist_id', 'release_id'],
+                select(literal(artist.id), Release.id).where(
+                    release_crud.discogs_id_any(release_ids)
+                ).order_by(Release.id)
+            ).on_conflict_do_nothing(index_elements=['artist_id', 'release_id']))
+        return artist
+
     def create_with_releases(self, db: Session, artist_in: ArtistCreate):
-        releases_db = []
-        for release in artist_in.releases:
+        releases_in = artist_in.releases or []
+        for release in releases_in:
             release.artists = []
-            db_release = release_crud.get_by_discogs_id(db=db, discogs_id=release.discogs_id)
-            if not db_release:
-                db_release = release_crud.create(db=db, obj_in=release)
-            releases_db.append(db_release)
+        release_crud.create_many(db=db, objs_in=releases_in)
 
         artist_in.releases = []
-        db_obj = self.get_by_discogs_id(db=db, discogs_id=artist_in.discogs_id)
-        if db_obj:
-            db_obj.releases.extend(releases_db)
-            db.add(db_obj)
-        else:
-            obj_in_data = jsonable_encoder(artist_in)
-            db_obj = self.model(**obj_in_data)
-            db_obj.releases.extend(releases_db)
-            db.add(db_obj)
+        # the upsert returns the artist id, so no lookups are needed between the statements
+        artist = self.upsert_and_link(
+            db=db, artist_in=artist_in, release_ids=[int(x.discogs_id) for x in releases_in]
+        )
         db.commit()
-        db.refresh(db_obj)
-        return db_obj
+        return self.get(db=db, id=artist.id)
 
 
 artist_crud = CRUDItem(Artist)
@@ -1,7 +1,10 @@
-from typing import Any, Dict, Generic, List, Optional, Type, TypeVar, Union
+from operator import itemgetter
+from typing import Any, Dict, Generic, Iterable, List, Mapping, Optional, Sequence, Set, Type, TypeVar, Union
 
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
+from sqlalchemy import Integer, any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY, insert
 from sqlalchemy.orm import Session
 
 from db.base_class import Base
@@ -26,6 +29,25 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     def get(self, db: Session, id: Any) -> Optional[ModelType]:
         return db.query(self.model).filter(self.model.id == id).first()
 
+    def existing_discogs_ids(self, db: Session, discogs_ids: Iterable[Any]) -> Set[int]:
+        """
+        Return which of `discogs_ids` already have a row, with a single `= ANY(array)` query on
+        the index.
+        """
+        discogs_ids = {int(x) for x in discogs_ids}
+        if not discogs_ids:
+            return set()
+        rows = db.query(self.model.discogs_id).filter(self.discogs_id_any(discogs_ids)).all()
+        return {row.discogs_id for row in rows}
+
+    def discogs_id_any(self, discogs_ids: Set[int]):
+        """
+        Filter matching rows whose discogs_id is in `discogs_ids`, as `discogs_id = ANY(:array)`.
+        One array parameter instead of an IN list with a bind per id, the plan stays the same
+        whatever the batch size.
+        """
+        return self.model.discogs_id == any_(bindparam('discogs_ids', list(discogs_ids), type_=ARRAY(Integer)))
+
     def get_multi(
         self, db: Session, *, skip: int = 0, limit: int = 100
     ) -> List[ModelType]:
@@ -39,6 +61,38 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         db.refresh(db_obj)
         return db_obj
 
+    def create_many(
+        self,
+        db: Session,
+        *,
+        objs_in: Iterable[Union[CreateSchemaType, Mapping[str, Any]]],
+        index_elements: Sequence[str] = ('discogs_id',),
+        batch_size: int = 500
+    ) -> None:
+        """
+        Insert all objects with one statement per `batch_size` rows, rows that clash on
+        `index_elements` are skipped. Rows go in sorted by `index_elements`, so concurrent
+        transactions lock the same keys in the same order instead of deadlocking. Plain
+        column -> value mappings skip the schema encoding. Nothing is committed, that is left
+        to the caller.
+        """
+        columns = set(self.model.__table__.columns.keys()) - {'id'}
+        rows = sorted(
+            (
+                {
+                    k: v for k, v in (obj_in if isinstance(obj_in, Mapping) else jsonable_encoder(obj_in)).items()
+                    if k in columns
+                }
+                for obj_in in objs_in
+            ),
+            key=itemgetter(*index_elements),
+        )
+        for start in range(0, len(rows), batch_size):
+            stmt = insert(self.model).values(rows[start:start + batch_size]).on_conflict_do_nothing(
+                index_elements=list(index_elements)
+            )
+            db.execute(stmt)
+
     def update(
         self,
         db: Session,
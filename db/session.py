@@ -8,5 +8,12 @@ SQLALCHEMY_DATABASE_URI = settings.database_url
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URI,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=True,
+    # reuse the most recently returned connection so idle ones can be recycled
+    pool_use_lifo=True,
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
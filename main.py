@@ -2,7 +2,9 @@ from fastapi import FastAPI
 
 from api.api import api_router
 from config.settings import settings
+from services.disco_conn import shutdown_pool
 
 app = FastAPI(title="Music Links")
+app.add_event_handler("shutdown", shutdown_pool)
 
 app.include_router(api_router, prefix=settings.api_v1)
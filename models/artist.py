@@ -2,7 +2,7 @@ from typing import List, Tuple, Optional
 from dataclasses import dataclass
 
 from sqlalchemy import Column, Integer, String, ForeignKey, Table
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import object_session, relationship
 
 from db.base_class import Base
 from models.release import Release
@@ -10,8 +10,8 @@ from models.release import Release
 artist_release = Table(
                     'artist_release',
                     Base.metadata,
-                    Column('artist_id', Integer, ForeignKey('artist.id')),
-                    Column('release_id', Integer, ForeignKey('release.id'))
+                    Column('artist_id', Integer, ForeignKey('artist.id'), primary_key=True),
+                    Column('release_id', Integer, ForeignKey('release.id'), primary_key=True)
                  )
 
 
@@ -33,6 +33,24 @@ class Artist(Base):
     previous: Tuple = None
     limit: int = 10
 
+    def get_collaborators(self) -> List[Tuple['Artist', str]]:
+        """
+        (artist, release title) for everyone sharing a release with this artist, fetched with a
+        single join instead of lazy loading every release and then its artists.
+        """
+        own = artist_release.alias('own')
+        other = artist_release.alias('other')
+        return object_session(self).query(Artist, Release.title).join(
+            other, other.c.artist_id == Artist.id
+        ).join(
+            own, own.c.release_id == other.c.release_id
+        ).join(
+            Release, Release.id == own.c.release_id
+        ).filter(
+            own.c.artist_id == self.id,
+            Artist.id != self.id,
+        ).order_by(Release.id).all()
+
     def get_connected_artists(self, step: int = 0, collected=None, visited=None):
         if step >= self.limit:
             return collected, visited
@@ -42,7 +60,7 @@ class Artist(Base):
         if collected is None:
             collected = {step: set()}
 
-        if step not in collected.keys():
+        if step not in collected:
             collected[step] = set()
 
         if visited is None:
@@ -50,14 +68,13 @@ class Artist(Base):
 
         visited.add(self.discogs_id)
 
-        for release in self.releases:
-            for artist in release.artists:
-                if artist.discogs_id != self.discogs_id and artist.discogs_id not in visited:
-                    artist.previous = (release.title, self.name)
-                    collected[step].add(artist)
-                    visited.add(artist)
-                    new_collected, new_visited = artist.get_connected_artists(step, collected, visited)
-                    visited.update(new_visited)
-                    collected.update(new_collected)
+        for artist, release_title in self.get_collaborators():
+            if artist.discogs_id not in visited:
+                artist.previous = (release_title, self.name)
+                collected[step].add(artist)
+                visited.add(artist)
+                new_collected, new_visited = artist.get_connected_artists(step, collected, visited)
+                visited.update(new_visited)
+                collected.update(new_collected)
 
         return collected, visited
@@ -1,27 +1,38 @@
-from typing import List, Optional, Dict, Set
+from typing import List, Optional, Dict, Set, Deque, FrozenSet, Union
+from collections import deque
 import dotenv
 from dataclasses import dataclass, field
+import logging
 import os
+import threading
 import time
 
 import discogs_client
 import requests.exceptions
 from discogs_client.exceptions import HTTPError
 
+from utils.rate_limit import TokenBucket, retry_on_rate_limit
 
-@dataclass
+log = logging.getLogger(__name__)
+
+# Discogs allows 60 authenticated requests per minute, shared by all worker threads
+REQUESTS_PER_MINUTE = 60
+REQUEST_BURST = 10
+
+
+@dataclass(slots=True)
 class Node:
     name: str
     discogs_id: int
     page_url: str = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ReleaseNode(Node):
     year: int = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ArtistNode(Node):
     image_url: str = None
     releases: List[ReleaseNode] = field(default_factory=list)
@@ -49,6 +60,7 @@ class DiscoConnector:
     request_secret: str = None
     token: str = None
     secret: str = None
+    bucket: TokenBucket = None
 
     def __init__(self, key, secret):
         self.client = discogs_client.Client(
@@ -56,6 +68,7 @@ class DiscoConnector:
             consumer_key=key,
             consumer_secret=secret
         )
+        self.bucket = TokenBucket(rate=REQUESTS_PER_MINUTE / 60, capacity=REQUEST_BURST)
 
     def get_new_token(self):
         self.request_token, self.request_secret, self.auth_url = self.client.get_authorize_url()
@@ -74,25 +87,37 @@ class DiscoConnector:
             self.get_new_token()
         try:
             return self.client.search(term, type=type)
-        except discogs_client.exceptions.HTTPError:
+        except discogs_client.exceptions.HTTPError as e:
+            # a rate limit is left to the caller's retry, only a refused token needs a new one
+            if e.status_code == 429:
+                raise
             self.get_new_token()
-            self.search(term, type)
+            return self.search(term, type)
 
     def set_token(self, token, secret):
         self.token = token
         self.secret = secret
         self.client.set_token(self.token, self.secret)
 
+    @retry_on_rate_limit(on_rate_limited=lambda self, *args: self.bucket.drain())
     def get_release(self, release_id):
-        return self.client.release(release_id)
+        release = self.client.release(release_id)
+        self.bucket.acquire()
+        release.refresh()
+        return release
 
+    @retry_on_rate_limit(on_rate_limited=lambda self, *args: self.bucket.drain())
     def get_artist(self, artist_id):
-        return self.client.artist(artist_id)
+        artist = self.client.artist(artist_id)
+        self.bucket.acquire()
+        artist.refresh()
+        return artist
 
     def search_artist(self, artist: str):
-        results = self.search(artist, type="artist")
-        for r in results:
-            if r.name == artist:
+        for r in self.iter_pages(self.search(artist, type="artist")):
+            # search hits only carry the name as 'title', reading r.name would refetch each one
+            if r.data.get('title') == artist:
+                r = self.get_artist(r.id)
                 artist_node = ArtistNode(
                     name=r.name,
                     discogs_id=r.id,
@@ -102,7 +127,7 @@ class DiscoConnector:
                 if r.images and len(r.images) > 0:
                     artist_node.image_url = r.images[0]['uri']
 
-                for rel in r.releases:
+                for rel in self.iter_pages(r.releases):
                     release = ReleaseNode(
                         name=rel.title,
                         discogs_id=rel.id,
@@ -112,20 +137,39 @@ class DiscoConnector:
                 return artist_node
         return None
 
+    def iter_pages(self, paginated):
+        """
+        Iterate a discogs paginated list a page at a time, every page request takes a token
+        from the bucket and is retried on 429 on its own.
+        """
+        # reading the page count loads the first page along with it
+        pages = self._paced(lambda: paginated.pages)
+        for number in range(1, pages + 1):
+            yield from paginated.page(1) if number == 1 else self._paced(paginated.page, number)
 
-@dataclass
+    @retry_on_rate_limit(on_rate_limited=lambda self, *args: self.bucket.drain())
+    def _paced(self, request, *args):
+        self.bucket.acquire()
+        return request(*args)
+
+
+@dataclass(slots=True)
 class ArtistFetcher:
-    term: str
+    term: Union[str, int]
     client: DiscoConnector
     depth: int
     count: int = 0
     artists: Dict = field(default_factory=dict)
     artist: ArtistNode = None
+    skip_names: FrozenSet[str] = frozenset()
 
     def fetch_artist(self, term):
-        artist = self.client.search(term, 'artist')
+        if isinstance(term, int):
+            artist = self.client.get_artist(term)
+        else:
+            match = next(self.client.iter_pages(self.client.search(term, 'artist')), None)
+            artist = self.client.get_artist(match.id) if match else None
         if artist:
-            artist = artist[0]
             artist_node = ArtistNode(
                 name=artist.name,
                 discogs_id=artist.id,
@@ -145,37 +189,32 @@ class ArtistFetcher:
         )
 
     def fetch_release_artists(self, discogs_id):
-        release = self.client.get_release(discogs_id)
-        self.artist.releases.append(release)
-
+        # the release is fetched eagerly, transport and payload errors come from get_release
         try:
-            return release.artists
-        except discogs_client.exceptions.HTTPError:
-            pass
-        except requests.exceptions.SSLError:
-            pass
-        except ValueError:
-            pass
-        return []
+            release = self.client.get_release(discogs_id)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            log.warning("Failed to fetch release %s: %s", discogs_id, e)
+            return []
+        self.artist.releases.append(release)
+        return release.artists
 
     def get_release_artists(self, release):
-        release_artists = self.fetch_release_artists(release.id)
-
         try:
+            release_artists = self.fetch_release_artists(release.id)
             for artist in release_artists:
                 self.increase_count()
 
-                if artist.name != self.term and \
-                        artist.name != "Various" and \
-                        artist.name not in self.artists.keys():
-                    self.artists.update({artist.name: artist})
+                if artist.name not in self.skip_names and \
+                        artist.id != self.artist.discogs_id and \
+                        artist.id not in self.artists:
+                    self.artists.update({artist.id: artist})
                 if self.count >= self.depth:
                     break
 
             self.increase_count()
 
         except discogs_client.exceptions.HTTPError as e:
-            print(e)
+            log.warning("Failed to fetch artists of release %s: %s", release.id, e)
 
     def increase_count(self):
         self.count += 1
@@ -185,7 +224,8 @@ class ArtistFetcher:
         if not artist:
             return None, None
 
-        for release in artist.releases:
+        self.skip_names = frozenset({self.term, "Various", self.artist.name})
+        for release in self.client.iter_pages(artist.releases):
             self.get_release_artists(release)
             if self.count >= self.depth:
                 break
@@ -193,65 +233,95 @@ class ArtistFetcher:
         return self.artists, self.artist
 
 
-@dataclass
+@dataclass(slots=True)
 class Traverser:
     term: str
     client: DiscoConnector
-    checked: Dict = field(default_factory=dict)
-    artist_collection: Set = None
-    count: int = 0
+    checked: Set[int] = field(default_factory=set)
+    payloads: Dict[int, ArtistNode] = field(default_factory=dict)
     max_artists: int = 10
+    workers: int = 4
+    worklist: Deque = field(default_factory=deque)
+    seen: Set = field(default_factory=set)
+    active: int = 0
+    lock: threading.Condition = field(default_factory=threading.Condition)
 
     def go_traverse(self):
-        self.artist_collection = set()
-        self.checked = {}
-        artists, _ = self.get_artist_related(self.term)
-        self.artists_loop(artists)
-        print("Results:\n")
-        for c in self.checked:
+        self.checked = set()
+        self.payloads = {}
+        self.async_run([self.term])
+        log.info("Results:")
+        for c in self.payloads:
             try:
-                print(self.checked[c])
+                log.info("%s", self.payloads[c])
             except discogs_client.exceptions.HTTPError:
-                print(c, ' 404 error')
-
-    def artists_loop(self, artists):
-        artist_count = 0
+                log.warning("%s 404 error", c)
+
+    def async_run(self, worklist):
+        """
+        Run `apply` on every artist of the worklist using a pool of workers, `propagation`
+        pushes newly found artist ids back until the worklist is empty or max_artists is reached.
+        """
+        self.worklist = deque()
+        self.seen = set()
+        self.active = 0
+        for term in worklist:
+            self.propagation(term)
+
+        threads = [threading.Thread(target=self.worker) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def worker(self):
         while True:
-            temp_artists = {}
-            print(f"Checking {len(artists)} artists...")
-            for artist in artists:
-                new_artists, new_artist = self.get_artist_related(artist)
-                self.checked[new_artist.name] = new_artist
-                print(f"Found new artists: {new_artists}")
-                for na in new_artists:
-                    if new_artists[na].name not in temp_artists.keys():
-                        temp_artists[new_artists[na].name] = new_artists[na]
-                self.artist_collection.update(set([x for x in new_artists.keys()]))
-                artist_count += 1
-                if artist_count >= self.max_artists:
-                    break
-
-            self.increase_count()
-            print(f"Count: {self.count}")
-            if self.count > 5 or not temp_artists:
-                break
-
-            artists = temp_artists
-
-    def increase_count(self):
-        self.count += 1
-
-    def get_artist_related(self, artist):
+            with self.lock:
+                while not self.worklist and self.active:
+                    self.lock.wait()
+                if not self.worklist or len(self.checked) >= self.max_artists:
+                    self.lock.notify_all()
+                    return
+                term = self.worklist.popleft()
+                self.active += 1
+
+            new_artists = {}
+            try:
+                new_artists = self.apply(term)
+            except Exception:
+                # one artist failing must not take its worker down, the rest keep draining the worklist
+                log.exception("Failed to traverse artist %s", term)
+            finally:
+                with self.lock:
+                    for artist_id in new_artists:
+                        self.propagation(artist_id)
+                    self.active -= 1
+                    self.lock.notify_all()
+
+    def apply(self, artist):
         traverser = ArtistFetcher(artist, self.client, depth=10)
 
         new_artists, new_artist = traverser.run()
-        self.checked[new_artist.name] = new_artist
-        print(f"Found new artists: {new_artists}")
-        return new_artists, new_artist
+        if not new_artist:
+            return {}
+
+        with self.lock:
+            self.checked.add(new_artist.discogs_id)
+            self.payloads[new_artist.discogs_id] = new_artist
+        log.debug("Found %d new artists for %s", len(new_artists), new_artist.name)
+        return new_artists
+
+    def propagation(self, artist):
+        # must be called while holding the lock
+        if artist in self.seen or artist in self.checked:
+            return
+        self.seen.add(artist)
+        self.worklist.append(artist)
 
 
 def fetch():
     dotenv.load_dotenv()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
     term = "Inside Riot"
 
     client = DiscoConnector(
@@ -0,0 +1,58 @@
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import Iterable, List, Optional, Set, Tuple
+
+
+class TraversalCheckpoint:
+    """
+    Progress of running traversals in a SQLite file, keyed by the starting artist, so a
+    traversal that died half way resumes from its frontier instead of crawling from zero.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript(
+                'CREATE TABLE IF NOT EXISTS progress (root INTEGER PRIMARY KEY, count INTEGER);'
+                'CREATE TABLE IF NOT EXISTS checked (root INTEGER, id INTEGER, PRIMARY KEY (root, id));'
+                'CREATE TABLE IF NOT EXISTS frontier (root INTEGER, pos INTEGER, id INTEGER, PRIMARY KEY (root, pos));'
+            )
+
+    def load(self, root: int) -> Optional[Tuple[Set[int], List[int], int]]:
+        """
+        Return (finished artist ids, frontier in order, artists counted) of an unfinished
+        traversal, None when there is nothing to resume.
+        """
+        with self._lock:
+            progress = self._conn.execute('SELECT count FROM progress WHERE root = ?', (root,)).fetchone()
+            if progress is None:
+                return None
+            checked = {x for x, in self._conn.execute('SELECT id FROM checked WHERE root = ?', (root,))}
+            frontier = [x for x, in self._conn.execute('SELECT id FROM frontier WHERE root = ? ORDER BY pos', (root,))]
+        return checked, frontier, progress[0]
+
+    def save(self, root: int, finished: int, frontier: Iterable[int], count: int) -> None:
+        """
+        Record that the step for `finished` is done. `frontier` has to include the artists whose
+        steps are still running, they are not finished yet.
+        """
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR IGNORE INTO checked VALUES (?, ?)', (root, finished))
+            self._conn.execute('DELETE FROM frontier WHERE root = ?', (root,))
+            self._conn.executemany(
+                'INSERT INTO frontier VALUES (?, ?, ?)', ((root, pos, x) for pos, x in enumerate(frontier))
+            )
+            self._conn.execute('INSERT OR REPLACE INTO progress VALUES (?, ?)', (root, count))
+
+    def clear(self, root: int) -> None:
+        with self._lock, self._conn:
+            for table in ('progress', 'checked', 'frontier'):
+                self._conn.execute(f'DELETE FROM {table} WHERE root = ?', (root,))
+
+
+@lru_cache(maxsize=1)
+def get_checkpoint(path: str) -> TraversalCheckpoint:
+    # one connection for every traversal, its lock already keeps them from interleaving
+    return TraversalCheckpoint(path)
@@ -1,10 +1,28 @@
-from typing import Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
 from dataclasses import dataclass
+from functools import lru_cache
 
 import discogs_client
 from discogs_client.exceptions import HTTPError
 
 from config.settings import settings
+from services.disco_cache import DiskCache, TTLCache
+from utils.rate_limit import TokenBucket, retry_on_rate_limit
+
+# Requests allowed in flight at once when fetching many resources together
+MAX_IN_FLIGHT = 8
+# Discogs allows 60 authenticated requests per minute over a moving window, bursts are kept
+# small so a burst plus the steady rate stays close to that
+REQUESTS_PER_MINUTE = 60
+REQUEST_BURST = 10
+# Threads shared by every concurrent fetch, enough for each traversal worker to have
+# MAX_IN_FLIGHT requests going
+POOL_SIZE = 32
+
+# one pool for every connector, connectors dropped from the cache don't leave threads behind
+_pool = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='discogs')
 
 
 @dataclass
@@ -15,13 +33,22 @@ class DiscoConnector:
     request_secret: str = None
     token: str = None
     secret: str = None
+    cache: TTLCache = None
+    bucket: TokenBucket = None
+    store: DiskCache = None
+    pool: ThreadPoolExecutor = None
 
-    def __init__(self, key, secret):
+    def __init__(self, key, secret, store: DiskCache = None):
         self.client = discogs_client.Client(
             "MaliRobot/1.0",
             consumer_key=key,
             consumer_secret=secret
         )
+        self.cache = TTLCache()
+        self.bucket = TokenBucket(rate=REQUESTS_PER_MINUTE / 60, capacity=REQUEST_BURST)
+        self.store = store
+        # the discogs client is blocking so concurrent fetches need threads
+        self.pool = _pool
 
     def get_new_token(self):
         # TODO - what to do about this propmt?
@@ -40,30 +67,141 @@ class DiscoConnector:
         if self.token is None:
             self.get_new_token()
         try:
+            # only builds the paginated list, nothing is requested until its pages are read,
+            # which is what fetch_all_pages paces
             return self.client.search(term, type=type)
         except discogs_client.exceptions.HTTPError:
             self.get_new_token()
-            self.search(term, type)
+            return self.search(term, type)
 
     def fetch_artist_by_discogs_id(self, discogs_id):
-        return self.client.artist(discogs_id)
+        return self.get_artist(discogs_id)
 
     def set_token(self, token, secret):
         self.token = token
         self.secret = secret
         self.client.set_token(self.token, self.secret)
 
+    def lazy_release(self, release_id):
+        """
+        Release handle that is only fetched when refreshed, e.g. through refresh_many.
+        """
+        return self.client.release(int(release_id))
+
     def get_release(self, release_id):
-        return self.client.release(release_id)
+        return self.cache.get_or_fetch(
+            ('release', int(release_id)), lambda: self._fetch(self.client.release, release_id)
+        )
 
     def get_artist(self, artist_id):
-        return self.client.artist(artist_id)
+        return self.cache.get_or_fetch(
+            ('artist', int(artist_id)), lambda: self._fetch(self.client.artist, artist_id)
+        )
 
+    def refresh_many(self, resources: Iterable, limit: int = MAX_IN_FLIGHT) -> list:
+        """
+        Fetch lazy discogs resources concurrently instead of one at a time on first attribute
+        access. They go through the memo like get_release, a resource another worker fetched or
+        is fetching is not requested again. A resource that failed comes back unfetched, the
+        failure is left for the caller to hit when it reads it.
+        """
+        resources = list(resources)
+        fetched = self._map_concurrently(self._refresh_cached, resources, limit)
+        return [x if isinstance(y, Exception) else y for x, y in zip(resources, fetched)]
 
-def init_disco_fetcher():
+    def fetch_all_pages(self, paginated, limit: int = MAX_IN_FLIGHT) -> list:
+        """
+        Read every page of a discogs paginated list, pages after the first are requested
+        concurrently. Items are returned in page order.
+        """
+        # reading the page count loads the first page along with it
+        count = self._paced(lambda: paginated.pages)
+        items = list(paginated.page(1))
+        pages = self._map_concurrently(
+            lambda number: self._paced(paginated.page, number), range(2, count + 1), limit
+        )
+        for page in pages:
+            if isinstance(page, Exception):
+                raise page
+            items.extend(page)
+        return items
+
+    def _map_concurrently(self, func, items, limit: int) -> list:
+        """
+        Run `func` over `items` on the shared pool, at most `limit` at a time. Results come back
+        in input order, an exception takes the place of the result of the call that raised it.
+        """
+        slots = threading.BoundedSemaphore(limit)
+
+        def run(item):
+            try:
+                return func(item)
+            except Exception as e:
+                return e
+            finally:
+                slots.release()
+
+        futures = []
+        for item in items:
+            slots.acquire()
+            futures.append(self.pool.submit(run, item))
+        return [x.result() for x in futures]
+
+    @retry_on_rate_limit(on_rate_limited=lambda self, *args: self.bucket.drain())
+    def _paced(self, request, *args):
+        self.bucket.acquire()
+        return request(*args)
+
+    def _fetch(self, getter, discogs_id):
+        return self._refresh(getter(discogs_id))
+
+    def _refresh_cached(self, resource):
+        key = (type(resource).__name__.lower(), int(resource.id))
+        return self.cache.get_or_fetch(key, lambda: self._refresh(resource))
+
+    @retry_on_rate_limit(on_rate_limited=lambda self, *args: self.bucket.drain())
+    def _refresh(self, resource):
+        key = f'{type(resource).__name__.lower()}:{resource.id}'
+        data = self.store.get(key) if self.store else None
+        if data is not None:
+            resource.data.update(data)
+            # counts as fetched, a key missing from the payload must not trigger an unpaced refresh
+            resource.previous_request = resource.data.get('resource_url')
+            return resource
+
+        self.bucket.acquire()
+        resource.refresh()
+        if self.store:
+            self.store.set(key, resource.data)
+        return resource
+
+
+@lru_cache(maxsize=4)
+def get_connector(key: str, secret: str, token: str, token_secret: str) -> DiscoConnector:
+    store = None
+    if settings.discogs_cache_path:
+        store = DiskCache(settings.discogs_cache_path, ttl=settings.discogs_cache_ttl)
     discogs_conn = DiscoConnector(
-        key=settings.discogs_key,
-        secret=settings.discogs_secret
+        key=key,
+        secret=secret,
+        store=store,
     )
-    discogs_conn.set_token(settings.token, settings.secret)
+    discogs_conn.set_token(token, token_secret)
     return discogs_conn
+
+
+def shutdown_pool():
+    """
+    Stop the fetch threads on application shutdown, queued fetches are cancelled.
+    """
+    _pool.shutdown(wait=True, cancel_futures=True)
+
+
+_connector_lock = threading.Lock()
+
+
+def init_disco_fetcher():
+    # lru_cache does not hold a lock while building, concurrent first requests would each
+    # create a connector with its own token bucket
+    with _connector_lock:
+        return get_connector(settings.discogs_key, settings.discogs_secret, settings.token, settings.secret)
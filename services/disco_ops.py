@@ -12,15 +12,16 @@ def artist_sorted_search(name: str) -> Dict[str, ArtistSearchResult]:
 
     discogs_conn = init_disco_fetcher()
     artists = discogs_conn.search(term=name, type='artist')
-    for i in range(artists.pages):
-        for artist in artists.page(i):
-            if artist.id not in search_results.keys():
-                artist_result = ArtistSearchResult(
-                    name=artist.name,
-                    discogs_id=artist.id,
-                    url=artist.url,
-                )
-                search_results[artist.name] = artist_result
+    # every page goes through the connector's rate limit, hits are read from the search payload
+    # as artist.name would fetch each artist again
+    for artist in discogs_conn.fetch_all_pages(artists):
+        if artist.id not in search_results:
+            artist_result = ArtistSearchResult(
+                name=artist.data['title'],
+                discogs_id=artist.id,
+                url=artist.url,
+            )
+            search_results[artist_result.name] = artist_result
 
     search_results = dict(
         sorted(search_results.items(), key=lambda sub: string_similarity_ratio(sub[1].name, name), reverse=True)
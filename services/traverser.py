@@ -1,176 +1,388 @@
-from typing import Set
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import chain
 from dataclasses import dataclass, field
 import discogs_client
 import discogs_client.exceptions
+import requests.exceptions
 
-from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, sessionmaker
 
+from config.settings import settings
 from crud.artist import artist_crud
 from crud.release import release_crud
 from models.artist import Artist
 from schemas.artist import ArtistCreate
-from schemas.release import ReleaseCreate
+from services.checkpoint import TraversalCheckpoint, get_checkpoint
 from services.disco_conn import DiscoConnector, init_disco_fetcher
 
 
+log = logging.getLogger(__name__)
+
 MAX_STEPS = 20
+# Discogs allows 60 authenticated requests a minute, more workers only queue on the limit
+MAX_WORKERS = 4
+# Values read from discogs are already typed, validation is only worth it when debugging
+VALIDATE_SCHEMAS = False
+# A step sends its buffered rows to the database once either limit is reached
+ARTIST_FLUSH = 50
+RELEASE_FLUSH = 2000
+# Placeholder artists Discogs puts on compilations, they link everything to everything
+SKIP_NAMES = frozenset({'Various', 'Various Artists'})
+# Compilations and orchestral recordings can credit hundreds of people, beyond this a release
+# adds queue growth rather than useful links
+MAX_COLLAB_PER_RELEASE = 64
+# Releases whose full payload is fetched and walked together
+RELEASE_CHUNK = 50
+
+DISCOGS_URL = 'https://www.discogs.com'
+
+
+def build_schema(schema, **values):
+    return schema(**values) if VALIDATE_SCHEMAS else schema.construct(**values)
+
+
+# Rows are read from the raw payload: going through the discogs_client model fields fetches
+# the whole resource again for any key the payload lacks, e.g. 'uri' is missing from the
+# entries of an artist's release list and from the artists embedded in a release.
+
+def release_row(release) -> Dict[str, Any]:
+    data = release.data
+    page_url = data.get('uri') or f"{DISCOGS_URL}/{data.get('type', 'release')}/{data['id']}"
+    return {
+        'title': data['title'],
+        'discogs_id': data['id'],
+        'page_url': page_url,
+        'year': data.get('year') or None,
+    }
+
+
+def artist_row(artist: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'name': artist['name'],
+        'discogs_id': artist['id'],
+        'page_url': f"{DISCOGS_URL}/artist/{artist['id']}",
+    }
+
+
+@dataclass(frozen=True, slots=True)
+class ArtistRef:
+    """
+    Stands in for an artist row this traversal has already written, only its discogs id is
+    needed to expand it.
+    """
+    discogs_id: int
 
 
-@dataclass
+@dataclass(slots=True)
 class StepTraverser:
-    discogs_id: str
+    discogs_id: int
     client: DiscoConnector
     db: Session
-    artists: Set = field(default_factory=set)
+    artists: Set[int] = field(default_factory=set)
     artist: Artist = None
+    # (artist, release) discogs id pairs packed into one int, a third of the memory of tuples
+    linked: Set[int] = field(default_factory=set)
+    explored_releases: Set[int] = field(default_factory=set)
+    known_artists: Set[int] = field(default_factory=set)
+    # off when the caller has already looked the artist up in the database
+    probe: bool = True
+    # the artist's release list, fetched once per step
+    listing: Optional[list] = None
+    # buffered as plain column -> value rows, handed to the inserts as they are
+    pending_artists: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+    pending_releases: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+    pending_links: Set[Tuple[int, int]] = field(default_factory=set)
+    walked_releases: Set[int] = field(default_factory=set)
 
     def get_or_create_artist(self):
-        artist = artist_crud.get_by_discogs_id(self.db, self.discogs_id)
+        if self.discogs_id in self.known_artists:
+            self.artist = ArtistRef(discogs_id=self.discogs_id)
+            return self.artist
+
+        artist = None
+        if self.probe:
+            artist = artist_crud.select_lean_by_discogs_id(self.db, self.discogs_id)
+            # the probe's transaction is not kept open over the discogs requests that follow
+            self.db.commit()
         if not artist:
             artist_discogs = self.client.fetch_artist_by_discogs_id(self.discogs_id)
             if not artist_discogs:
                 return None
 
-            artist_in = ArtistCreate(
+            artist_in = build_schema(
+                ArtistCreate,
                 name=artist_discogs.name,
                 discogs_id=artist_discogs.id,
                 page_url=artist_discogs.url,
             )
 
-            artist_in.releases = [
-                ReleaseCreate(
-                    title=x.title,
-                    discogs_id=x.id,
-                    page_url=x.url,
-                    year=x.year,
-                ) for x in artist_discogs.releases
-            ]
-
-            artist = artist_crud.create_with_releases(db=self.db, artist_in=artist_in)
+            # the listing is fetched once, it gives the release rows here and the walk later
+            self.listing = self.client.fetch_all_pages(artist_discogs.releases)
+            try:
+                release_crud.create_many(db=self.db, objs_in=[release_row(x) for x in self.listing])
+                artist = artist_crud.upsert_and_link(
+                    db=self.db,
+                    artist_in=artist_in,
+                    release_ids=[x.id for x in self.listing],
+                )
+                self.db.commit()
+            except SQLAlchemyError:
+                self.db.rollback()
+                raise
 
         self.artist = artist
         return self.artist
 
     def get_artist_releases(self):
-        if self.artist:
-            if 'page_url' in dir(self.artist):
-                artist = self.client.get_artist(artist_id=self.artist.discogs_id)
-                return artist.releases
-            return self.artist.releases
-        return []
+        if self.listing is None and self.artist:
+            artist = self.client.get_artist(artist_id=self.artist.discogs_id)
+            self.listing = self.client.fetch_all_pages(artist.releases)
+        return self.listing or []
 
     def check_artist_releases(self):
+        release_ids = {}
         for release in self.get_artist_releases():
-            if 'main_release' in dir(release):
-                release = release.main_release
-            try:
-                for artist in release.artists:
-                    if artist.id != self.artist.discogs_id and artist.name != 'Various':
-                        self.artists.add(artist.id)
-                        self.add_release_to_artist(artist, release)
-                if 'extraartists' in dir(release):
-                    for ex_artist in release.extraartists:
-                        if ex_artist.id != self.artist.discogs_id and ex_artist.name != 'Various':
-                            self.artists.add(ex_artist.id)
-                            self.add_release_to_artist(ex_artist, release)
-                for artist in release.credits:
-                    if artist.id != self.artist.discogs_id and artist.name != 'Various':
-                        self.artists.add(artist.id)
-                        self.add_release_to_artist(artist, release)
-
-            except discogs_client.exceptions.HTTPError as e:
-                print('err: ', str(e))
-            except AttributeError:
-                print('master', dir(release), release.title)
-
-        print(self.artists)
+            if hasattr(type(release), 'main_release'):
+                # a master stands for its main release, the list entry carries its id
+                release_id = release.data.get('main_release') or release.main_release.id
+            else:
+                release_id = release.id
+            if release_id not in self.explored_releases:
+                release_ids.setdefault(release_id)
+
+        # full release payloads are fetched and walked a chunk at a time, only one chunk of
+        # them is held in memory
+        release_ids = list(release_ids)
+        for start in range(0, len(release_ids), RELEASE_CHUNK):
+            chunk = release_ids[start:start + RELEASE_CHUNK]
+            self.walk_releases(self.client.refresh_many(self.client.lazy_release(x) for x in chunk))
+
+        self.save_pending()
+        log.debug('discovered %d artists', len(self.artists))
         return self.artists
 
-    def add_release_to_artist(self, artist, release_discogs):
-        release_in = ReleaseCreate(
-            title=release_discogs.title,
-            discogs_id=release_discogs.id,
-            page_url=release_discogs.url,
-            year=release_discogs.year,
-        )
-        db_artist = artist_crud.get_by_discogs_id(db=self.db, discogs_id=artist.id)
-        if db_artist:
-            release = release_crud.get_by_discogs_id(db=self.db, discogs_id=release_discogs.id)
-            if not release:
-                release = release_crud.create(db=self.db, obj_in=release_in)
-            artist_crud.add_artist_release(db=self.db, artist_id=db_artist.id,
-                                           release=release)
-        else:
-            artist_crud.create_with_releases(
-                db=self.db,
-                artist_in=ArtistCreate(
-                    name=artist.name,
-                    discogs_id=artist.id,
-                    page_url=artist.url,
-                    releases=[
-                        release_in
-                    ]
-                )
-            )
+    def walk_releases(self, releases):
+        self_id = self.artist.discogs_id
+        add_release_to_artist = self.add_release_to_artist
+        for release in releases:
+            if release.id in self.explored_releases or release.id in self.walked_releases:
+                continue
+            data = release.data
+            if 'title' not in data:
+                log.warning('could not read release %s', release.id)
+                continue
+            self.walked_releases.add(release.id)
+            row = release_row(release)
+            # a known artist was never linked by upsert_and_link, and for a master the listing
+            # linked the master id rather than this main release
+            self.add_link(self_id, row)
+            # the same person often shows up as artist and in the credits (extraartists)
+            seen = {self_id}
+            for artist in chain(data.get('artists') or (), data.get('extraartists') or ()):
+                artist_id = artist.get('id')
+                if not artist_id or artist_id in seen or artist.get('name') in SKIP_NAMES:
+                    continue
+                if len(seen) > MAX_COLLAB_PER_RELEASE:
+                    log.debug('release %s has too many artists, stopped after %d', row['discogs_id'], len(seen))
+                    break
+                seen.add(artist_id)
+                add_release_to_artist(artist, row)
+            seen.discard(self_id)
+            self.artists.update(seen)
+
+            if len(self.pending_releases) >= RELEASE_FLUSH or len(self.pending_artists) >= ARTIST_FLUSH:
+                self.save_pending()
+
+    def run(self):
+        artist = self.get_or_create_artist()
+        if not artist:
+            return None
+        self.check_artist_releases()
+        return artist
+
+    def add_release_to_artist(self, artist: Dict[str, Any], release_row: Dict[str, Any]):
+        if self.add_link(artist['id'], release_row) and artist['id'] not in self.pending_artists:
+            self.pending_artists[artist['id']] = artist_row(artist)
+
+    def add_link(self, artist_id: int, release_row: Dict[str, Any]) -> bool:
+        """
+        Buffer the link and the release row, False when the link is pending or written already.
+        The artist row has to exist or be buffered by the caller.
+        """
+        link = (artist_id, release_row['discogs_id'])
+        if link in self.pending_links or ((link[0] << 32) | link[1]) in self.linked:
+            return False
+        self.pending_releases.setdefault(link[1], release_row)
+        self.pending_links.add(link)
+        return True
 
+    def save_pending(self):
+        """
+        Write the buffered rows and commit them. Runs whenever a buffer fills up and at the end
+        of the step, a transaction never stays open over the discogs requests in between.
+        """
+        try:
+            artist_crud.create_many(db=self.db, objs_in=list(self.pending_artists.values()))
+            release_crud.create_many(db=self.db, objs_in=list(self.pending_releases.values()))
+            artist_crud.link_releases(db=self.db, links=self.pending_links)
+            self.db.commit()
+        except SQLAlchemyError:
+            self.db.rollback()
+            raise
+        # only shared once committed, a rolled back step leaves them to be redone
+        self.known_artists.update(self.pending_artists)
+        self.linked.update((a << 32) | r for a, r in self.pending_links)
+        self.explored_releases.update(self.walked_releases)
+        self.walked_releases.clear()
+        self.pending_artists.clear()
+        self.pending_releases.clear()
+        self.pending_links.clear()
 
-@dataclass
+
+@dataclass(slots=True)
 class Traverser:
-    discogs_id: str
+    discogs_id: int
     client: DiscoConnector
     db: Session
-    checked: Set = field(default_factory=set)
+    # artists whose step was started, a plain set: only about max_artists ids end up here and
+    # evicting one would let the frontier filter queue that artist again
+    checked: Set[int] = field(default_factory=set)
     count: int = 0
     max_artists: int = 100
-    artists: Set = field(default_factory=set)
+    artists: Set[int] = field(default_factory=set)
+    frontier: Deque[int] = field(default_factory=deque)
+    # (artist, release) discogs id pairs packed into one int, a third of the memory of tuples
+    linked: Set[int] = field(default_factory=set)
+    explored_releases: Set[int] = field(default_factory=set)
+    known_artists: Set[int] = field(default_factory=set)
+    max_workers: int = MAX_WORKERS
+    session_factory: sessionmaker = None
+    checkpoint: TraversalCheckpoint = None
 
     def begin_traverse(self):
-        self.checked = set()
-        first_step = StepTraverser(
+        if self.session_factory is None:
+            self.session_factory = sessionmaker(bind=self.db.get_bind(), autocommit=False, autoflush=False)
+
+        state = self.checkpoint.load(self.discogs_id) if self.checkpoint else None
+        if state:
+            checked, frontier, self.count = state
+            self.checked.update(checked)
+            self.artists = set(frontier)
+            self.frontier = deque(frontier)
+            log.info('resuming traversal of %s after %d artists', self.discogs_id, self.count)
+        else:
+            if not self.first_step():
+                return
+            self.frontier = deque(self.artists)
+
+        self.traverse_loop()
+        if self.checkpoint:
+            self.checkpoint.clear(self.discogs_id)
+
+    def first_step(self):
+        step = StepTraverser(
             discogs_id=self.discogs_id,
             client=self.client,
-            db=self.db
+            db=self.db,
+            linked=self.linked,
+            explored_releases=self.explored_releases,
+            known_artists=self.known_artists,
         )
-        artist = first_step.get_or_create_artist()
-        self.checked.add(artist)
-        first_step.check_artist_releases()
-        self.artists = first_step.artists
-        return self.traverse_loop()
+        artist = step.run()
+        if artist is None:
+            return None
+        self.checked.add(self.discogs_id)
+        self.count += 1
+        self.artists = step.artists
+        if self.checkpoint:
+            self.checkpoint.save(self.discogs_id, self.discogs_id, self.artists, self.count)
+        return artist
 
     def traverse_loop(self):
-        while True:
-            if len(self.artists) == 0:
-                break
+        """
+        BFS over a FIFO frontier kept saturated: up to `max_workers` steps run at once and as
+        soon as one finishes, the collaborators it found are queued and the next artist is
+        started, nobody waits for the slowest step of a level.
+        """
+        self.frontier = deque(x for x in self.frontier if x not in self.checked)
+        queued = set(self.frontier)
+        self.look_up_known(self.frontier)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while self.frontier or running:
+                # steps still running count against the budget until they are known to fail
+                room = min(self.max_workers, self.max_artists - self.count) - len(running)
+                while room > 0 and self.frontier:
+                    discogs_id = self.frontier.popleft()
+                    self.checked.add(discogs_id)
+                    running[executor.submit(self.run_step, discogs_id)] = discogs_id
+                    room -= 1
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    discogs_id = running.pop(future)
+                    found = future.result()
+                    if found is not None:
+                        self.count += 1
+                        new_ids = found.difference(self.checked, queued)
+                        self.look_up_known(new_ids)
+                        self.frontier.extend(new_ids)
+                        queued.update(new_ids)
+                    if self.checkpoint:
+                        # steps still running go back in front, they are redone after a crash
+                        pending = chain(running.values(), self.frontier)
+                        self.checkpoint.save(self.discogs_id, discogs_id, pending, self.count)
+
+    def look_up_known(self, discogs_ids):
+        # one lookup per batch of newly queued artists instead of a probe per step, whatever
+        # isn't known after it is new and its step goes straight to discogs
+        self.known_artists.update(artist_crud.existing_discogs_ids(
+            self.db, (x for x in discogs_ids if x not in self.known_artists)
+        ))
 
-            artist = self.artists.pop()
+    def run_step(self, discogs_id: int) -> Optional[Set[int]]:
+        # sessions are not thread safe, every step gets its own from the shared engine pool
+        db = self.session_factory()
+        try:
             step = StepTraverser(
-                discogs_id=artist,
+                discogs_id=discogs_id,
                 client=self.client,
-                db=self.db
+                db=db,
+                linked=self.linked,
+                explored_releases=self.explored_releases,
+                known_artists=self.known_artists,
+                probe=False,
             )
-
-            artist = step.get_or_create_artist()
-            if not artist:
-                continue
-
-            self.checked.add(artist)
-            step.check_artist_releases()
-            ids_to_check = step.artists
-            ids_to_check = set([x for x in ids_to_check if x not in self.checked])
-            self.artists.update(ids_to_check)
-
-            if self.artists is None or self.count is self.max_artists:
-                break
-            del step
-            self.count += 1
+            if step.run() is None:
+                return None
+            return step.artists
+        except (
+            discogs_client.exceptions.HTTPError, requests.exceptions.RequestException, SQLAlchemyError, ValueError
+        ) as e:
+            # one artist failing, e.g. on a deadlock, a dropped connection or an error page that
+            # is not JSON, doesn't end the traversal
+            log.warning('could not traverse artist %s: %s', discogs_id, e)
+            return None
+        finally:
+            db.close()
 
 
 def start_traversing(discogs_id: str, db: Session, max_artists: int = 20):
     discogs_client = init_disco_fetcher()
+    checkpoint = None
+    if settings.traversal_checkpoint_path:
+        checkpoint = get_checkpoint(settings.traversal_checkpoint_path)
     traverser = Traverser(
-        discogs_id=discogs_id,
+        discogs_id=int(discogs_id),
         client=discogs_client,
         max_artists=max_artists,
         db=db,
+        checkpoint=checkpoint,
     )
     traverser.begin_traverse()
@@ -0,0 +1,72 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from crud.artist import artist_crud
+from services.checkpoint import TraversalCheckpoint, get_checkpoint
+from services.traverser import Traverser
+
+
+class CrashAfterFirstSave(TraversalCheckpoint):
+    """
+    Dies on the second save, the way a process would be killed half way through a traversal.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.saved = threading.Event()
+
+    def save(self, *args):
+        if self.saved.is_set():
+            raise RuntimeError('killed')
+        super().save(*args)
+        self.saved.set()
+
+
+def make_traverser(checkpoint):
+    return Traverser(
+        discogs_id=1, client=MagicMock(), db=MagicMock(), max_artists=10, max_workers=2,
+        session_factory=MagicMock(), checkpoint=checkpoint,
+    )
+
+
+def test_traversal_resumes_from_checkpoint(tmp_path):
+    path = str(tmp_path / 'checkpoint.sqlite')
+    # the first step of artist 1 is done and found 2 and 3
+    TraversalCheckpoint(path).save(1, 1, [2, 3], 1)
+
+    crashing = CrashAfterFirstSave(path)
+
+    def first_run(discogs_id):
+        if discogs_id == 3:
+            # still running when the step of 2 is saved
+            crashing.saved.wait(5)
+            return set()
+        return {4}
+
+    with patch.object(artist_crud, 'existing_discogs_ids', return_value=set()), \
+            patch.object(Traverser, 'run_step', side_effect=first_run), pytest.raises(RuntimeError):
+        make_traverser(crashing).begin_traverse()
+
+    checkpoint = TraversalCheckpoint(path)
+    # 3 was running, it goes back in front of what 2 found
+    assert checkpoint.load(1) == ({1, 2}, [3, 4], 2)
+
+    traverser = make_traverser(checkpoint)
+    with patch.object(artist_crud, 'existing_discogs_ids', return_value=set()), \
+            patch.object(Traverser, 'run_step', return_value=set()) as run_step, \
+            patch.object(Traverser, 'first_step') as first_step:
+        traverser.begin_traverse()
+
+    first_step.assert_not_called()
+    assert sorted(x.args[0] for x in run_step.call_args_list) == [3, 4]
+    assert traverser.checked == {1, 2, 3, 4}
+    assert traverser.count == 4
+    assert checkpoint.load(1) is None
+
+
+def test_traversals_share_one_checkpoint_connection(tmp_path):
+    path = str(tmp_path / 'checkpoint.sqlite')
+
+    assert get_checkpoint(path) is get_checkpoint(path)
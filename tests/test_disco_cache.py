@@ -0,0 +1,62 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from services.disco_cache import DiskCache, TTLCache
+
+
+def test_concurrent_misses_share_one_fetch():
+    cache = TTLCache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fetch():
+        started.set()
+        release.wait(5)
+        return 'artist'
+
+    fetch = MagicMock(side_effect=fetch)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(cache.get_or_fetch, 1, fetch)
+        started.wait(5)
+        second = pool.submit(cache.get_or_fetch, 1, fetch)
+        time.sleep(0.05)  # let the second caller reach the in-flight fetch
+        release.set()
+        assert first.result() == second.result() == 'artist'
+
+    assert fetch.call_count == 1
+
+
+def test_entry_expires_after_ttl():
+    cache = TTLCache(ttl=10)
+    with patch('services.disco_cache.time.monotonic', return_value=100):
+        cache.set(1, 'artist')
+    with patch('services.disco_cache.time.monotonic', return_value=109):
+        assert cache.get(1) == 'artist'
+    with patch('services.disco_cache.time.monotonic', return_value=111):
+        assert cache.get(1) is None
+
+
+def test_failed_fetch_is_not_cached():
+    cache = TTLCache()
+    with pytest.raises(ValueError):
+        cache.get_or_fetch(1, MagicMock(side_effect=ValueError('bad payload')))
+
+    assert cache.get_or_fetch(1, lambda: 'artist') == 'artist'
+
+
+def test_disk_cache_keeps_payloads_until_ttl(tmp_path):
+    path = str(tmp_path / 'discogs.sqlite')
+    with patch('services.disco_cache.time.time', return_value=100):
+        DiskCache(path, ttl=10).set('release:5', {'id': 5, 'title': 'Release 5'})
+
+    # a new instance reads what an earlier run stored
+    cache = DiskCache(path, ttl=10)
+    with patch('services.disco_cache.time.time', return_value=109):
+        assert cache.get('release:5') == {'id': 5, 'title': 'Release 5'}
+    with patch('services.disco_cache.time.time', return_value=111):
+        assert cache.get('release:5') is None
+    assert cache.get('release:6') is None
@@ -0,0 +1,64 @@
+from unittest.mock import MagicMock, patch
+
+from services.disco_conn import DiscoConnector
+from services.disco_ops import artist_sorted_search
+
+
+def test_release_restored_from_store_is_not_fetched_again():
+    store = MagicMock()
+    store.get.return_value = {'id': 5, 'title': 'Release 5', 'resource_url': 'https://api.discogs.com/releases/5'}
+    conn = DiscoConnector(key='key', secret='secret', store=store)
+    conn.client._get = MagicMock()
+
+    release = conn.get_release(5)
+
+    assert release.title == 'Release 5'
+    # a key the stored payload lacks reads as missing instead of refreshing around the bucket
+    assert release.fetch('notes') is None
+    conn.client._get.assert_not_called()
+    store.set.assert_not_called()
+
+
+def test_search_pages_take_a_token_each_and_hits_are_not_refetched():
+    conn = DiscoConnector(key='key', secret='secret')
+    conn.set_token('token', 'secret')
+    conn.bucket = MagicMock()
+    conn.client._get = MagicMock(side_effect=lambda url: {
+        'pagination': {'pages': 2, 'items': 2},
+        'results': [{
+            'id': 2 if 'page=2' in url else 1,
+            'title': 'Page 2' if 'page=2' in url else 'Page 1',
+            'uri': '/artist/1',
+            'type': 'artist',
+        }],
+    })
+
+    with patch('services.disco_ops.init_disco_fetcher', return_value=conn):
+        results = artist_sorted_search('Page')
+
+    assert set(results) == {'Page 1', 'Page 2'}
+    assert conn.client._get.call_count == 2
+    assert conn.bucket.acquire.call_count == 2
+
+
+def test_refresh_many_shares_releases_through_the_memo():
+    conn = DiscoConnector(key='key', secret='secret')
+    conn.client._get = MagicMock(side_effect=lambda url: {'id': int(url.rsplit('/', 1)[1]), 'title': url})
+
+    first = conn.refresh_many([conn.lazy_release(1), conn.lazy_release(2)])
+    again = conn.refresh_many([conn.lazy_release(2)])
+
+    assert [x.id for x in first] == [1, 2]
+    assert again[0] is first[1]
+    assert conn.get_release(1) is first[0]
+    assert conn.client._get.call_count == 2
+
+
+def test_refresh_many_returns_failed_resources_unfetched():
+    conn = DiscoConnector(key='key', secret='secret')
+    conn.client._get = MagicMock(side_effect=ValueError('not json'))
+
+    release = conn.lazy_release(3)
+
+    assert conn.refresh_many([release]) == [release]
+    assert 'title' not in release.data
@@ -0,0 +1,72 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from discogs_client.exceptions import HTTPError
+
+from utils.rate_limit import TokenBucket, retry_on_rate_limit
+
+
+def make_bucket(rate=1, capacity=2):
+    with patch('utils.rate_limit.time.monotonic', return_value=0):
+        return TokenBucket(rate=rate, capacity=capacity)
+
+
+def test_bucket_lets_a_burst_through_then_reserves_slots():
+    bucket = make_bucket()
+    sleeps = []
+
+    def sleep(seconds):
+        # the wait happens after the lock is released, other callers can reserve meanwhile
+        assert not bucket._lock.locked()
+        sleeps.append(seconds)
+
+    with patch('utils.rate_limit.time.monotonic', return_value=0), \
+            patch('utils.rate_limit.time.sleep', side_effect=sleep):
+        for _ in range(4):
+            bucket.acquire()
+
+    assert sleeps == [1, 2]
+
+
+def test_drain_makes_the_next_caller_wait_for_the_refill():
+    bucket = make_bucket()
+    with patch('utils.rate_limit.time.monotonic', return_value=0), \
+            patch('utils.rate_limit.time.sleep') as sleep:
+        bucket.drain()
+        bucket.acquire()
+
+    sleep.assert_called_once_with(1)
+
+
+def rate_limited(times, then='ok'):
+    return MagicMock(side_effect=[HTTPError('Too Many Requests', 429)] * times + [then])
+
+
+def test_retry_backs_off_and_reports_each_429():
+    func = rate_limited(2)
+    on_rate_limited = MagicMock()
+    with patch('utils.rate_limit.time.sleep') as sleep:
+        result = retry_on_rate_limit(on_rate_limited=on_rate_limited)(func)('release', 5)
+
+    assert result == 'ok'
+    assert [x.args[0] for x in sleep.call_args_list] == [1, 2]
+    assert on_rate_limited.call_count == 2
+    on_rate_limited.assert_called_with('release', 5)
+
+
+def test_retry_caps_the_delay_and_gives_up_after_max_attempts():
+    func = rate_limited(5)
+    with patch('utils.rate_limit.time.sleep') as sleep, pytest.raises(HTTPError):
+        retry_on_rate_limit(max_attempts=5, max_delay=3)(func)()
+
+    assert func.call_count == 5
+    assert [x.args[0] for x in sleep.call_args_list] == [1, 2, 3, 3]
+
+
+def test_retry_raises_other_errors_straight_away():
+    func = MagicMock(side_effect=HTTPError('Not Found', 404))
+    with patch('utils.rate_limit.time.sleep') as sleep, pytest.raises(HTTPError):
+        retry_on_rate_limit()(func)()
+
+    assert func.call_count == 1
+    sleep.assert_not_called()
@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests.exceptions
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+
+from crud.artist import artist_crud
+from crud.release import release_crud
+from services.traverser import StepTraverser, Traverser
+
+
+def make_artist(discogs_id, name='Artist'):
+    return {'id': discogs_id, 'name': name, 'resource_url': f'https://api.discogs.com/artists/{discogs_id}'}
+
+
+def make_release(discogs_id, artists=(), extraartists=()):
+    return SimpleNamespace(id=discogs_id, data={
+        'id': discogs_id,
+        'title': f'Release {discogs_id}',
+        'uri': f'https://www.discogs.com/release/{discogs_id}',
+        'year': 1984,
+        'artists': list(artists),
+        'extraartists': list(extraartists),
+    })
+
+
+def make_step(releases):
+    client = MagicMock()
+    client.fetch_all_pages.return_value = releases
+    client.lazy_release.side_effect = {x.id: x for x in releases}.get
+    client.refresh_many.side_effect = list
+    step = StepTraverser(discogs_id=1, client=client, db=MagicMock())
+    step.artist = SimpleNamespace(discogs_id=1)
+    return step
+
+
+def test_collaborator_is_linked_once_per_release():
+    collaborator = make_artist(2)
+    release = make_release(10, artists=[collaborator], extraartists=[collaborator])
+    step = make_step([release])
+
+    linked = []
+    with patch.object(artist_crud, 'create_many') as create_artists, \
+            patch.object(release_crud, 'create_many') as create_releases, \
+            patch.object(artist_crud, 'link_releases', side_effect=lambda db, links: linked.append(set(links))):
+        step.check_artist_releases()
+
+    assert step.artists == {2}
+    assert len(create_artists.call_args.kwargs['objs_in']) == 1
+    assert len(create_releases.call_args.kwargs['objs_in']) == 1
+    assert linked == [{(1, 10), (2, 10)}]
+    assert step.explored_releases == {10}
+    assert step.linked == {(1 << 32) | 10, (2 << 32) | 10}
+
+
+def test_failed_commit_leaves_releases_and_links_to_be_redone():
+    collaborator = make_artist(2)
+    step = make_step([make_release(10, artists=[collaborator])])
+    step.db.commit.side_effect = SQLAlchemyError('deadlock detected')
+
+    with patch.object(artist_crud, 'create_many'), patch.object(release_crud, 'create_many'), \
+            patch.object(artist_crud, 'link_releases'), pytest.raises(SQLAlchemyError):
+        step.check_artist_releases()
+
+    step.db.rollback.assert_called_once()
+    assert not step.explored_releases
+    assert not step.linked
+    assert not step.known_artists
+
+
+def test_failing_step_is_logged_and_skipped():
+    traverser = Traverser(discogs_id=1, client=MagicMock(), db=MagicMock(), session_factory=MagicMock())
+
+    with patch.object(StepTraverser, 'run', side_effect=OperationalError('SELECT 1', {}, Exception('gone'))):
+        assert traverser.run_step(2) is None
+    with patch.object(StepTraverser, 'run', side_effect=requests.exceptions.ConnectionError('reset')):
+        assert traverser.run_step(3) is None
+    # discogs_client decodes an error body before checking the status
+    with patch.object(StepTraverser, 'run', side_effect=ValueError('Expecting value')):
+        assert traverser.run_step(4) is None
+
+    assert traverser.session_factory.return_value.close.call_count == 3
+
+
+def run_loop(run_step, **kwargs):
+    traverser = Traverser(discogs_id=1, client=MagicMock(), db=MagicMock(), count=1, checked={1}, **kwargs)
+    with patch.object(artist_crud, 'existing_discogs_ids', return_value=set()), \
+            patch.object(Traverser, 'run_step', side_effect=run_step) as stub:
+        traverser.traverse_loop()
+    return traverser, [x.args[0] for x in stub.call_args_list]
+
+
+def test_traverse_loop_never_goes_over_max_artists():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def run_step(discogs_id):
+        with lock:
+            running.append(discogs_id)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(discogs_id)
+        # every step finds more than the budget can take
+        return {discogs_id * 10, discogs_id * 10 + 1}
+
+    traverser, started = run_loop(run_step, max_artists=4, max_workers=3, frontier=deque([2, 3]))
+
+    assert traverser.count == 4
+    assert len(started) == 3
+    assert max(peak) <= 3
+
+
+def test_failed_step_frees_its_budget():
+    traverser, started = run_loop(
+        lambda discogs_id: None if discogs_id == 2 else set(),
+        max_artists=3, max_workers=2, frontier=deque([2, 3, 4, 5]),
+    )
+
+    assert traverser.count == 3
+    assert sorted(started) == [2, 3, 4]
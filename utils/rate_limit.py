@@ -0,0 +1,64 @@
+import threading
+import time
+from functools import wraps
+from typing import Callable
+
+from discogs_client.exceptions import HTTPError
+
+
+def retry_on_rate_limit(max_attempts: int = 5, max_delay: int = 60, on_rate_limited: Callable = None):
+    """
+    Retry the decorated call when Discogs answers with 429 Too Many Requests, sleeping
+    1, 2, 4... seconds (capped at `max_delay`) between attempts. Any other error, or a 429
+    on the last attempt, is raised to the caller. `on_rate_limited` is called with the
+    call's arguments on every 429.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(max_attempts):
+                try:
+                    return func(*args, **kwargs)
+                except HTTPError as e:
+                    if e.status_code != 429 or attempt == max_attempts - 1:
+                        raise
+                    if on_rate_limited:
+                        on_rate_limited(*args, **kwargs)
+                    time.sleep(min(max_delay, 2 ** attempt))
+        return wrapper
+    return decorator
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket shared by every call to an API. `acquire` sleeps only as long as
+    needed to stay under `rate` calls per second, bursts of up to `capacity` calls go through
+    straight away.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # going negative reserves the slot, later callers queue up behind it
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+    def drain(self) -> None:
+        """
+        Drop the tokens on hand, used when the server says the limit was hit after all so
+        every caller waits for the refill rather than only the one that was refused.
+        """
+        with self._lock:
+            self._tokens = min(self._tokens, 0)
+            self._last = time.monotonic()